@@ -8,18 +8,31 @@ Good News Agent - updated with detailed logging and robust feed handling
 """
 
 import os
+import io
+import json
+import sqlite3
 import logging
 import traceback
 import hashlib
 import datetime
+import time
+import threading
+from collections import defaultdict
+from contextlib import closing
+from urllib.parse import urlparse
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 from bs4 import BeautifulSoup
+from lxml import etree
 from deep_translator import GoogleTranslator
 from email.mime.text import MIMEText
 from email.mime.multipart import MIMEMultipart
 from email.mime.application import MIMEApplication
 import smtplib
 import re
+from html import escape, unescape
+from concurrent.futures import ThreadPoolExecutor, as_completed
 
 # ---------------------- Logging ----------------------
 logging.basicConfig(level=logging.DEBUG, format="%(asctime)s %(levelname)s: %(message)s")
@@ -29,6 +42,12 @@ CONFIG = {
     "languages": ["en"],
     "max_articles": 25,
     "summary_max_chars": 280,
+    "fetch_workers": 8,
+    "per_host_limit": 4,
+    "feed_max_failures": 3,
+    "feed_block_seconds": 6 * 3600,
+    "translate_workers": 8,
+    "translation_ttl_days": 7,
     "rss_feeds": [
         "https://www.smithsonianmag.com/rss/travel",
         "https://www.smithsonianmag.com/rss/science-nature",
@@ -46,6 +65,28 @@ CONFIG = {
     ]
 }
 CONFIG["rss_feeds"] = list(dict.fromkeys(CONFIG["rss_feeds"]))
+CACHE_DIR = os.path.join(os.path.expanduser("~"), ".cache", "good_news_agent")
+TRANSLATION_DB_FILE = os.path.join(CACHE_DIR, "translate.sqlite3")
+FEED_CACHE_FILE = os.path.join(CACHE_DIR, "feed_cache.json")
+FEED_HEALTH_FILE = os.path.join(CACHE_DIR, "feed_health.json")
+
+# ---------------------- HTTP session ----------------------
+SESSION = requests.Session()
+# Retry throttling/5xx responses, but not read timeouts: a hung feed would otherwise
+# hold the whole run for several full timeouts.
+_retry = Retry(total=3, connect=1, read=0, backoff_factor=0.5,
+               status_forcelist=[429, 500, 502, 503, 504], allowed_methods=["GET"])
+_adapter = HTTPAdapter(pool_connections=16, pool_maxsize=16, max_retries=_retry)
+SESSION.mount("https://", _adapter)
+SESSION.mount("http://", _adapter)
+SESSION.headers.update({"User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64)"})
+
+_HOST_SLOTS = defaultdict(lambda: threading.BoundedSemaphore(CONFIG["per_host_limit"]))
+_HOST_SLOTS_LOCK = threading.Lock()
+
+def host_slot(url):
+    with _HOST_SLOTS_LOCK:
+        return _HOST_SLOTS[urlparse(url).netloc]
 
 # ---------------------- Email ----------------------
 EMAIL_USER = os.getenv("EMAIL_USER")
@@ -56,111 +97,284 @@ if not EMAIL_USER or not EMAIL_PASSWORD or not EMAIL_TO:
     logging.warning("Email credentials not fully set in environment. Email sending may fail.")
 
 # ---------------------- Helpers ----------------------
+_WS_RE = re.compile(r"\s+")
+_TAG_RE = re.compile(r"<[^>]+>")
+_REGEX_CLEAN_MAX_CHARS = 2000
+
 def clean_html_summary(html_text):
     if not html_text:
         return ""
-    text = BeautifulSoup(html_text, "html.parser").get_text(separator=" ", strip=True)
-    return re.sub(r"\s+", " ", text).strip()
+    if len(html_text) > _REGEX_CLEAN_MAX_CHARS:
+        text = BeautifulSoup(html_text, "lxml").get_text(separator=" ", strip=True)
+    else:
+        text = unescape(_TAG_RE.sub(" ", html_text))
+    return _WS_RE.sub(" ", text).strip()
+
+def translation_key(text, target):
+    return hashlib.sha1(f"{target}|{text}".encode("utf-8")).hexdigest()
+
+# ---------------------- Disk caches ----------------------
+def load_json_cache(path):
+    try:
+        with open(path, encoding="utf-8") as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return {}
+    except Exception as e:
+        logging.debug(f"Ignoring unreadable cache {path}: {e}")
+        return {}
+
+def save_json_cache(path, data):
+    try:
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump(data, f, ensure_ascii=False)
+    except Exception as e:
+        logging.debug(f"Failed to save cache {path}: {e}")
+
+def open_translation_db(path):
+    db = sqlite3.connect(path)
+    db.execute("CREATE TABLE IF NOT EXISTS translations (key TEXT PRIMARY KEY, value TEXT, ts INTEGER)")
+    return db
+
+def load_translation_cache(path=TRANSLATION_DB_FILE):
+    if not os.path.exists(path):
+        return {}
+    cutoff = int(time.time()) - CONFIG["translation_ttl_days"] * 86400
+    try:
+        with closing(open_translation_db(path)) as db:
+            return dict(db.execute("SELECT key, value FROM translations WHERE ts >= ?", (cutoff,)))
+    except Exception as e:
+        logging.debug(f"Ignoring unreadable translation cache {path}: {e}")
+        return {}
+
+def save_translation_cache(path=TRANSLATION_DB_FILE):
+    now = int(time.time())
+    cutoff = now - CONFIG["translation_ttl_days"] * 86400
+    try:
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with closing(open_translation_db(path)) as db, db:
+            # Prune first so re-translated expired keys are not ignored by the insert below;
+            # OR IGNORE keeps the original timestamp so live entries still expire after the TTL.
+            db.execute("DELETE FROM translations WHERE ts < ?", (cutoff,))
+            db.executemany("INSERT OR IGNORE INTO translations (key, value, ts) VALUES (?, ?, ?)",
+                           [(k, v, now) for k, v in TRANSLATION_CACHE.items()])
+    except Exception as e:
+        logging.debug(f"Failed to save translation cache {path}: {e}")
+
+TRANSLATION_CACHE = load_translation_cache()
+# Keys whose translation failed this run; they fall back to the source text without retrying.
+TRANSLATION_FAILURES = set()
+FEED_CACHE = load_json_cache(FEED_CACHE_FILE)
+FEED_HEALTH = load_json_cache(FEED_HEALTH_FILE)
+
+def save_caches():
+    save_translation_cache()
+    save_json_cache(FEED_CACHE_FILE, FEED_CACHE)
+    save_json_cache(FEED_HEALTH_FILE, FEED_HEALTH)
+
+_TRANSLATORS = threading.local()
+
+def get_translator(target):
+    # GoogleTranslator mutates its URL params per call, so instances are per thread.
+    by_target = getattr(_TRANSLATORS, "by_target", None)
+    if by_target is None:
+        by_target = _TRANSLATORS.by_target = {}
+    if target not in by_target:
+        by_target[target] = GoogleTranslator(source='auto', target=target)
+    return by_target[target]
+
+_TARGET_SCRIPT_RES = {"he": re.compile(r"[\u0590-\u05FF]")}
+_LATIN_RE = re.compile(r"[A-Za-z]")
+
+def already_in_target(text, target):
+    script_re = _TARGET_SCRIPT_RES.get(target)
+    return bool(script_re and script_re.search(text) and not _LATIN_RE.search(text))
 
 def translate_text(text, target="he"):
     if not text:
         return ""
+    if already_in_target(text, target):
+        return text
+    key = translation_key(text, target)
+    cached = TRANSLATION_CACHE.get(key)
+    if cached is not None:
+        return cached
+    if key in TRANSLATION_FAILURES:
+        return text
     try:
-        return GoogleTranslator(source='auto', target=target).translate(text)
+        translated = get_translator(target).translate(text)
     except Exception as e:
         logging.debug(f"Translation failed: {e}")
+        translated = None
+    if not translated:
+        TRANSLATION_FAILURES.add(key)
         return text
+    TRANSLATION_CACHE[key] = translated
+    return translated
 
-def hashlib_sha1(s):
-    import hashlib
-    return hashlib.sha1(s.encode("utf-8")).hexdigest()
+def translate_many(texts, target="he"):
+    misses = list(dict.fromkeys(t for t in texts if t and translation_key(t, target) not in TRANSLATION_CACHE
+                                and translation_key(t, target) not in TRANSLATION_FAILURES))
+    done = {}
+    if misses:
+        workers = max(1, min(CONFIG["translate_workers"], len(misses)))
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            done = dict(zip(misses, executor.map(lambda t: translate_text(t, target), misses)))
+    return [done[t] if t in done else translate_text(t, target) for t in texts]
 
-def dedupe_articles(articles):
-    seen = set()
+def dedupe_articles(articles, seen=None):
+    if seen is None:
+        seen = set()
     out = []
     for a in articles:
-        key = hashlib_sha1((a.get("link") or "") + (a.get("title") or ""))
+        key = a.get("link") or a.get("title") or ""
         if key not in seen:
             seen.add(key)
             out.append(a)
     return out
 
 # ---------------------- Fetch RSS with robust logging ----------------------
+def parse_feed(content):
+    items = []
+    events = etree.iterparse(io.BytesIO(content), events=("end",), recover=True,
+                             resolve_entities=False, no_network=True)
+    for _, el in events:
+        if not isinstance(el.tag, str) or etree.QName(el).localname not in ("item", "entry"):
+            continue
+        fields = {}
+        for child in el:
+            if not isinstance(child.tag, str):
+                continue
+            name = etree.QName(child).localname
+            if name in fields:
+                continue
+            if name == "link":
+                fields[name] = child.get("href") or child.text or ''
+            else:
+                fields[name] = "".join(child.itertext())
+        items.append({
+            'title': fields.get('title', ''),
+            'description': fields.get('description', fields.get('summary', '')),
+            'link': fields.get('link', ''),
+            'pubDate': fields.get('pubDate', fields.get('updated', '')),
+        })
+        el.clear()
+    return items
+
+def record_feed_failure(url):
+    health = FEED_HEALTH.setdefault(url, {"fails": 0, "until": 0})
+    health["fails"] += 1
+    if health["fails"] >= CONFIG["feed_max_failures"]:
+        health["until"] = time.time() + CONFIG["feed_block_seconds"]
+        logging.debug(f"Blocking feed {url} after {health['fails']} consecutive failures")
+
 def fetch_rss_feed(url):
+    health = FEED_HEALTH.get(url)
+    if health and time.time() < health.get("until", 0):
+        logging.debug(f"Skipping blocked feed {url} ({health['fails']} consecutive failures)")
+        return []
     try:
         logging.debug(f"Fetching RSS feed: {url}")
-        headers = {"User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64)"}
-        r = requests.get(url, timeout=25, headers=headers)
+        cached = FEED_CACHE.get(url)
+        headers = {}
+        if cached:
+            if cached.get("etag"):
+                headers["If-None-Match"] = cached["etag"]
+            if cached.get("last_modified"):
+                headers["If-Modified-Since"] = cached["last_modified"]
+        with host_slot(url):
+            r = SESSION.get(url, timeout=(5, 25), headers=headers)
+        if r.status_code == 304 and cached:
+            logging.debug(f"Feed {url} not modified, reusing {len(cached['items'])} cached items")
+            FEED_HEALTH.pop(url, None)
+            return cached["items"]
         r.raise_for_status()
-        soup = BeautifulSoup(r.content, "xml")
-        items = []
-        for item in soup.find_all(["item", "entry"]):
-            title = item.title.text if item.title else ''
-            desc = ''
-            if item.find('description'):
-                desc = item.description.text
-            elif item.find('summary'):
-                desc = item.summary.text
-            link = ''
-            if item.find('link'):
-                link_tag = item.find('link')
-                link = link_tag['href'] if link_tag.has_attr('href') else link_tag.text
-            pub = item.pubDate.text if item.pubDate else (item.updated.text if item.find('updated') else '')
-            items.append({'title': title, 'description': desc, 'link': link, 'pubDate': pub})
+        items = parse_feed(r.content)
+        etag, last_modified = r.headers.get("ETag"), r.headers.get("Last-Modified")
+        if etag or last_modified:
+            FEED_CACHE[url] = {"etag": etag, "last_modified": last_modified, "items": items}
+        else:
+            FEED_CACHE.pop(url, None)
         logging.debug(f"Fetched {len(items)} items from {url}")
+        if items:
+            FEED_HEALTH.pop(url, None)
+        else:
+            record_feed_failure(url)
         return items
     except Exception as e:
         logging.debug(f"Skipping feed {url} due to error: {e}")
+        record_feed_failure(url)
         return []
 
 # ---------------------- Build HTML digest ----------------------
-def build_html_digest(articles):
+def digest_texts(article):
+    return article.get("title", ""), clean_html_summary(article.get("description", ""))[:CONFIG["summary_max_chars"]]
+
+def build_html_digest(articles, out):
     now = datetime.datetime.now().strftime("%Y-%m-%d %H:%M")
-    parts = [
-        "<!doctype html>",
-        "<html><head><meta charset='utf-8'><meta name='viewport' content='width=device-width,initial-scale=1'>",
-        "<style>body{font-family:-apple-system,BlinkMacSystemFont,'Segoe UI',Roboto,Helvetica,Arial,sans-serif;background:#f7f7f7;color:#111;direction:rtl;margin:0;padding:20px}.container{max-width:900px;margin:0 auto;background:#fff;padding:28px;border-radius:8px;box-shadow:0 6px 18px rgba(0,0,0,0.08)}header{border-bottom:1px solid #eee;padding-bottom:14px;margin-bottom:18px}h1{font-size:28px;margin:0;text-align:center;color:#222;font-weight:700}.lead{font-size:14px;color:#666;text-align:center;margin-top:6px}.sections{display:grid;grid-template-columns:1fr 320px;grid-gap:20px}.main{padding-right:6px}.aside{background:#fafafa;padding:12px;border-radius:6px;border:1px solid #f0f0f0}.article{margin-bottom:20px;padding-bottom:12px;border-bottom:1px solid #eee}.title{font-size:18px;color:#0b3d91;margin:0 0 6px 0;font-weight:700}.meta{font-size:12px;color:#777;margin-bottom:6px}.summary{font-size:14px;color:#222;line-height:1.6;text-align:justify}a{color:#0b3d91;text-decoration:none;border-bottom:1px dotted rgba(11,61,145,0.15)}a:hover{text-decoration:underline}footer{margin-top:20px;padding-top:12px;border-top:1px solid #eee;font-size:12px;color:#666;text-align:center}@media(max-width:720px){.sections{grid-template-columns:1fr}.aside{order:2}}</style>",
-        f"</head><body><div class='container'><header><h1>Good News Digest</h1><div class='lead'>עדכון — {now} | חדשות טובות מהעולם בתרגום לעברית</div></header>",
-        "<div class='sections'><div class='main'>"
-    ]
+    def write(line):
+        out.write(line)
+        out.write("\n")
+
+    write("<!doctype html>")
+    write("<html><head><meta charset='utf-8'><meta name='viewport' content='width=device-width,initial-scale=1'>")
+    write("<style>body{font-family:-apple-system,BlinkMacSystemFont,'Segoe UI',Roboto,Helvetica,Arial,sans-serif;background:#f7f7f7;color:#111;direction:rtl;margin:0;padding:20px}.container{max-width:900px;margin:0 auto;background:#fff;padding:28px;border-radius:8px;box-shadow:0 6px 18px rgba(0,0,0,0.08)}header{border-bottom:1px solid #eee;padding-bottom:14px;margin-bottom:18px}h1{font-size:28px;margin:0;text-align:center;color:#222;font-weight:700}.lead{font-size:14px;color:#666;text-align:center;margin-top:6px}.sections{display:grid;grid-template-columns:1fr 320px;grid-gap:20px}.main{padding-right:6px}.aside{background:#fafafa;padding:12px;border-radius:6px;border:1px solid #f0f0f0}.article{margin-bottom:20px;padding-bottom:12px;border-bottom:1px solid #eee}.title{font-size:18px;color:#0b3d91;margin:0 0 6px 0;font-weight:700}.meta{font-size:12px;color:#777;margin-bottom:6px}.summary{font-size:14px;color:#222;line-height:1.6;text-align:justify}a{color:#0b3d91;text-decoration:none;border-bottom:1px dotted rgba(11,61,145,0.15)}a:hover{text-decoration:underline}footer{margin-top:20px;padding-top:12px;border-top:1px solid #eee;font-size:12px;color:#666;text-align:center}@media(max-width:720px){.sections{grid-template-columns:1fr}.aside{order:2}}</style>")
+    write(f"</head><body><div class='container'><header><h1>Good News Digest</h1><div class='lead'>עדכון — {now} | חדשות טובות מהעולם בתרגום לעברית</div></header>")
+    write("<div class='sections'><div class='main'>")
     if not articles:
-        parts.append("<p>לא נמצאו ידיעות בזמן החיפוש. נסי להריץ שוב מאוחר יותר או הרחיבי את מקורות ה-RSS.</p>")
+        write("<p>לא נמצאו ידיעות בזמן החיפוש. נסי להריץ שוב מאוחר יותר או הרחיבי את מקורות ה-RSS.</p>")
     else:
+        texts = []
         for a in articles:
-            title_he = translate_text(a.get("title", ""))
-            summary_he = translate_text(a.get("description", "")[:CONFIG["summary_max_chars"]])
-            link = a.get("link", "#")
-            pub = a.get("pubDate", "")
-            parts.append("<div class='article'>")
-            parts.append(f"<div class='title'><a href='{link}' target='_blank'>{title_he}</a></div>")
+            texts.extend(digest_texts(a))
+        translations = translate_many(texts)
+        for i, a in enumerate(articles):
+            title_he = escape(translations[2 * i])
+            summary_he = escape(translations[2 * i + 1])
+            link = escape(a.get("link") or "#", quote=True)
+            pub = escape(a.get("pubDate", ""))
+            write("<div class='article'>")
+            write(f"<div class='title'><a href='{link}' target='_blank'>{title_he}</a></div>")
             if pub:
-                parts.append(f"<div class='meta'>{pub}</div>")
+                write(f"<div class='meta'>{pub}</div>")
             if summary_he:
-                parts.append(f"<div class='summary'>{summary_he}</div>")
-            parts.append("</div>")
-    parts.append("</div><aside class='aside'><h3 style='margin-top:0'>סקירה מהירה</h3>")
-    parts.append(f"<p>מספר ידיעות שנאספו: {len(articles)}</p>")
-    parts.append("</aside></div><footer><div>נוצר על-ידי Good News Agent — מייל יומי עם חדשות טובות</div></footer></div></body></html>")
-    return "\n".join(parts)
+                write(f"<div class='summary'>{summary_he}</div>")
+            write("</div>")
+    write("</div><aside class='aside'><h3 style='margin-top:0'>סקירה מהירה</h3>")
+    write(f"<p>מספר ידיעות שנאספו: {len(articles)}</p>")
+    write("</aside></div><footer><div>נוצר על-ידי Good News Agent — מייל יומי עם חדשות טובות</div></footer></div></body></html>")
 
 # ---------------------- Send Email ----------------------
-def send_email(html):
+def build_email(html_bytes):
+    msg = MIMEMultipart()
+    msg["From"] = EMAIL_USER
+    msg["To"] = EMAIL_TO
+    msg["Subject"] = "Good News Digest"
+    msg.attach(MIMEText("מצורף דוח החדשות הטובות להיום (לינקים ותקצירים).", "plain", "utf-8"))
+    attachment = MIMEApplication(html_bytes, _subtype="html")
+    attachment.add_header("Content-Disposition", "attachment", filename="good_news_digest.html")
+    msg.attach(attachment)
+    return msg
+
+def open_smtp():
+    server = smtplib.SMTP("smtp.gmail.com", 587, timeout=30)
+    try:
+        server.ehlo()
+        server.starttls()
+        server.login(EMAIL_USER, EMAIL_PASSWORD)
+    except Exception:
+        server.close()
+        raise
+    return server
+
+def send_email(html_bytes):
     if not (EMAIL_USER and EMAIL_PASSWORD and EMAIL_TO):
         logging.info("Email credentials not set; skipping email send.")
         return False
     try:
-        msg = MIMEMultipart()
-        msg["From"] = EMAIL_USER
-        msg["To"] = EMAIL_TO
-        msg["Subject"] = "Good News Digest"
-        msg.attach(MIMEText("מצורף דוח החדשות הטובות להיום (לינקים ותקצירים).", "plain", "utf-8"))
-        attachment = MIMEApplication(html.encode("utf-8"), _subtype="html")
-        attachment.add_header("Content-Disposition", "attachment", filename="good_news_digest.html")
-        msg.attach(attachment)
-        with smtplib.SMTP("smtp.gmail.com", 587, timeout=30) as server:
-            server.ehlo()
-            server.starttls()
-            server.login(EMAIL_USER, EMAIL_PASSWORD)
+        msg = build_email(html_bytes)
+        with open_smtp() as server:
             server.send_message(msg)
         logging.info("Email sent to %s", EMAIL_TO)
         return True
@@ -173,33 +387,54 @@ def send_email(html):
 def run():
     logging.info("Good News Agent starting")
     collected = []
+    seen = set()
     try:
-        for url in CONFIG["rss_feeds"]:
-            try:
-                items = fetch_rss_feed(url)
-                if not items:
-                    logging.debug(f"No items fetched from {url}, skipping")
-                    continue
-                collected.extend(items[:CONFIG["max_articles"]])
-            except Exception as e:
-                logging.debug(f"Error processing feed {url}: {e}")
+        urls = CONFIG["rss_feeds"]
+        results = {}
+        prefetched = set()
+        queued = set()
+        workers = max(1, min(CONFIG["fetch_workers"], len(urls)))
+        # Start translating each feed's items as soon as it arrives, so the
+        # translation round-trips overlap with feeds that are still loading.
+        with ThreadPoolExecutor(max_workers=workers) as fetch_pool, \
+                ThreadPoolExecutor(max_workers=CONFIG["translate_workers"]) as translate_pool:
+            futures = {fetch_pool.submit(fetch_rss_feed, url): url for url in urls}
+            for future in as_completed(futures):
+                items = future.result()[:CONFIG["max_articles"]]
+                results[futures[future]] = items
+                for a in dedupe_articles(items, prefetched):
+                    for text in digest_texts(a):
+                        if text and text not in queued:
+                            queued.add(text)
+                            translate_pool.submit(translate_text, text)
+        for url in urls:
+            items = results[url]
+            if not items:
+                logging.debug(f"No items fetched from {url}, skipping")
                 continue
-        collected = dedupe_articles(collected)
-        html = build_html_digest(collected)
-        with open("good_news_digest.html", "w", encoding="utf-8") as f:
-            f.write(html)
-        send_email(html)
+            collected.extend(dedupe_articles(items, seen))
+        buf = io.StringIO()
+        build_html_digest(collected, buf)
+        html_bytes = buf.getvalue().encode("utf-8")
+        with open("good_news_digest.html", "wb") as f:
+            f.write(html_bytes)
+        if collected:
+            send_email(html_bytes)
+        else:
+            logging.info("No articles collected; skipping email send.")
     except Exception as e:
         logging.error("Unhandled exception: %s", e)
         logging.debug(traceback.format_exc())
         err_html = f"<html><body><h3>Good News Agent - Error</h3><pre>{str(e)}\n\n{traceback.format_exc()}</pre></body></html>"
-        with open("good_news_digest_error.html", "w", encoding="utf-8") as f:
-            f.write(err_html)
+        err_bytes = err_html.encode("utf-8")
+        with open("good_news_digest_error.html", "wb") as f:
+            f.write(err_bytes)
         if EMAIL_USER and EMAIL_PASSWORD and EMAIL_TO:
             try:
-                send_email(err_html)
+                send_email(err_bytes)
             except Exception:
                 logging.debug("Failed to send error email")
+    save_caches()
     logging.info("Good News Agent finished")
 
 if __name__ == "__main__":